@@ -5,7 +5,12 @@ from lnbits.tasks import create_permanent_unique_task
 from loguru import logger
 
 from .crud import db
-from .tasks import wait_for_paid_invoices
+from .tasks import (
+    run_payment_recovery,
+    run_score_refresh,
+    run_tribute_settlement,
+    wait_for_paid_invoices,
+)
 from .views import paidreviews_generic_router
 from .views_api import paidreviews_api_router
 
@@ -34,6 +39,16 @@ def paidreviews_stop():
 def paidreviews_start():
     task = create_permanent_unique_task("ext_paidreviews", wait_for_paid_invoices)
     scheduled_tasks.append(task)
+    task = create_permanent_unique_task(
+        "ext_paidreviews_tributes", run_tribute_settlement
+    )
+    scheduled_tasks.append(task)
+    task = create_permanent_unique_task(
+        "ext_paidreviews_recovery", run_payment_recovery
+    )
+    scheduled_tasks.append(task)
+    task = create_permanent_unique_task("ext_paidreviews_scores", run_score_refresh)
+    scheduled_tasks.append(task)
 
 
 __all__ = [
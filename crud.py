@@ -1,32 +1,52 @@
+from lnbits.core.db import db as core_db
+from lnbits.core.models import PaymentState
 from lnbits.db import Connection, Database, Filters, Page
 
-from .models import PRSettings, RatingsFilters, RatingStats, Review
+from .helpers import SCORE_PRIOR_COUNT
+from .models import (
+    BulkModeration,
+    PRSettings,
+    RatingsFilters,
+    RatingStats,
+    Review,
+    TributeAccrual,
+    TributeReport,
+    TributeSettlement,
+)
 
 db = Database("ext_paidreviews")
 
 ############################# Settings #############################
 
 
-async def create_settings(data: PRSettings) -> PRSettings:
-    await db.insert("paidreviews.prsettings", data)
+async def create_settings(
+    data: PRSettings, conn: Connection | None = None
+) -> PRSettings:
+    await (conn or db).insert("paidreviews.prsettings", data)
     return PRSettings(**data.dict())
 
 
-async def update_settings(data: PRSettings) -> PRSettings:
-    await db.update("paidreviews.prsettings", data)
+async def update_settings(
+    data: PRSettings, conn: Connection | None = None
+) -> PRSettings:
+    await (conn or db).update("paidreviews.prsettings", data)
     return PRSettings(**data.dict())
 
 
-async def get_settings(user_id: str) -> PRSettings | None:
-    return await db.fetchone(
+async def get_settings(
+    user_id: str, conn: Connection | None = None
+) -> PRSettings | None:
+    return await (conn or db).fetchone(
         "SELECT * FROM paidreviews.prsettings WHERE user_id = :user_id",
         {"user_id": user_id},
         PRSettings,
     )
 
 
-async def get_settings_from_id(settings_id: str) -> PRSettings | None:
-    return await db.fetchone(
+async def get_settings_from_id(
+    settings_id: str, conn: Connection | None = None
+) -> PRSettings | None:
+    return await (conn or db).fetchone(
         "SELECT * FROM paidreviews.prsettings WHERE id = :id",
         {"id": settings_id},
         PRSettings,
@@ -36,31 +56,35 @@ async def get_settings_from_id(settings_id: str) -> PRSettings | None:
 ############################# Reviews #############################
 
 
-async def create_review(data: Review) -> Review:
-    await db.insert("paidreviews.reviews", data)
+async def create_review(data: Review, conn: Connection | None = None) -> Review:
+    await (conn or db).insert("paidreviews.reviews", data)
     return data
 
 
-async def get_reviews(settings_id: str | list[str]) -> list[Review]:
-    return await db.fetchall(
+async def get_reviews(
+    settings_id: str | list[str], conn: Connection | None = None
+) -> list[Review]:
+    return await (conn or db).fetchall(
         "SELECT * FROM paidreviews.reviews "
-        "WHERE settings_id = :settings_id AND paid = :paid "
+        "WHERE settings_id = :settings_id AND paid = :paid AND hidden = :hidden "
         "ORDER BY CAST(created_at AS INTEGER) DESC",
-        {"settings_id": settings_id, "paid": True},
+        {"settings_id": settings_id, "paid": True, "hidden": False},
         model=Review,
     )
 
 
-async def get_review(review_id: str) -> Review | None:
-    return await db.fetchone(
+async def get_review(review_id: str, conn: Connection | None = None) -> Review | None:
+    return await (conn or db).fetchone(
         "SELECT * FROM paidreviews.reviews WHERE id = :id",
         {"id": review_id},
         Review,
     )
 
 
-async def get_review_by_hash(payment_hash: str) -> Review | None:
-    return await db.fetchone(
+async def get_review_by_hash(
+    payment_hash: str, conn: Connection | None = None
+) -> Review | None:
+    return await (conn or db).fetchone(
         "SELECT * FROM paidreviews.reviews WHERE payment_hash = :payment_hash",
         {"payment_hash": payment_hash},
         Review,
@@ -72,57 +96,501 @@ async def get_reviews_by_tag(
     tag: str,
     *,
     filters: Filters[RatingsFilters] | None = None,
+    hidden: bool = False,
     conn: Connection | None = None,
 ) -> Page[Review]:
     filters = filters or Filters()
     filters.sortby = filters.sortby or "created_at"
     return await (conn or db).fetch_page(
         query="SELECT * FROM paidreviews.reviews",
-        where=["settings_id = :settings_id", "tag = :tag", "paid = :paid"],
-        values={"settings_id": settings_id, "tag": tag, "paid": True},
+        where=[
+            "settings_id = :settings_id",
+            "tag = :tag",
+            "paid = :paid",
+            "hidden = :hidden",
+        ],
+        values={"settings_id": settings_id, "tag": tag, "paid": True, "hidden": hidden},
         filters=filters,
         model=Review,
         table_name="paidreviews.reviews",
     )
 
 
-async def update_review(data: Review) -> Review:
-    await db.update("paidreviews.reviews", data)
+async def update_review(data: Review, conn: Connection | None = None) -> Review:
+    await (conn or db).update("paidreviews.reviews", data)
     return data
 
 
-async def get_rating_stats(settings_id: str, tag: str) -> RatingStats:
+async def set_review_paid(
+    payment_hash: str, score: float, conn: Connection | None = None
+) -> bool:
+    """
+    Mark the unpaid review of `payment_hash` as paid. Returns False if another
+    writer already did, so callers act on a payment exactly once.
+    """
+    result = await (conn or db).execute(
+        """
+        UPDATE paidreviews.reviews SET paid = :paid, score = :score
+        WHERE payment_hash = :payment_hash AND paid = :unpaid
+        """,
+        {"payment_hash": payment_hash, "score": score, "paid": True, "unpaid": False},
+    )
+    return result.rowcount == 1
+
+
+async def get_rating_stats(
+    settings_id: str, tag: str, conn: Connection | None = None
+) -> RatingStats:
     """
     Return aggregate stats (count + average) for paid reviews of a settings_id/tag.
-    Backed by the paidreviews_view_review_stats DB view.
+    Backed by the paidreviews_view_review_stats DB view. The bayesian average
+    is smoothed towards the mean rating across all tags of the settings, so a
+    tag without reviews yet gets that mean (None if the settings has none).
     """
-    row = await db.fetchone(
+    row = await (conn or db).fetchone(
         """
-        SELECT review_count, avg_rating
-        FROM paidreviews.paidreviews_view_review_stats
-        WHERE settings_id = :settings_id AND tag = :tag
+        SELECT
+          COALESCE(stats.review_count, 0) AS review_count,
+          COALESCE(stats.avg_rating, 0) AS avg_rating,
+          (:prior_count * prior.mean
+            + COALESCE(stats.review_count * stats.avg_rating, 0))
+            / (:prior_count + COALESCE(stats.review_count, 0)) AS bayes_avg_rating
+        FROM
+          (
+            SELECT SUM(review_count * avg_rating) / SUM(review_count) AS mean
+            FROM paidreviews.paidreviews_view_review_stats
+            WHERE settings_id = :settings_id
+          ) prior
+        LEFT JOIN paidreviews.paidreviews_view_review_stats stats
+          ON stats.settings_id = :settings_id AND stats.tag = :tag
         """,
-        {"settings_id": settings_id, "tag": tag},
+        {"settings_id": settings_id, "tag": tag, "prior_count": SCORE_PRIOR_COUNT},
         RatingStats,  # let the DB wrapper hydrate the model
     )
     return row or RatingStats(review_count=0, avg_rating=0)
 
 
-async def get_rating_stats_for_all_tags(settings_id: str) -> list[RatingStats]:
-    return await db.fetchall(
+async def get_rating_stats_for_all_tags(
+    settings_id: str, conn: Connection | None = None
+) -> list[RatingStats]:
+    return await (conn or db).fetchall(
         """
-        SELECT tag, review_count, avg_rating
-        FROM paidreviews.paidreviews_view_review_stats
+        SELECT
+          tag,
+          review_count,
+          avg_rating,
+          (:prior_count * prior.mean + review_count * avg_rating)
+            / (:prior_count + review_count) AS bayes_avg_rating
+        FROM paidreviews.paidreviews_view_review_stats,
+          (
+            SELECT COALESCE(
+              SUM(review_count * avg_rating) / SUM(review_count), 0
+            ) AS mean
+            FROM paidreviews.paidreviews_view_review_stats
+            WHERE settings_id = :settings_id
+          ) prior
         WHERE settings_id = :settings_id
         ORDER BY review_count DESC, tag ASC
         """,
-        {"settings_id": settings_id},
+        {"settings_id": settings_id, "prior_count": SCORE_PRIOR_COUNT},
         RatingStats,
     )
 
 
-async def delete_review(review_id: str) -> None:
-    await db.execute(
+async def get_scored_settings_ids(conn: Connection | None = None) -> list[str]:
+    rows = await (conn or db).fetchall(
+        "SELECT DISTINCT settings_id FROM paidreviews.reviews WHERE paid = :paid",
+        {"paid": True},
+    )
+    return [row["settings_id"] for row in rows]
+
+
+async def get_reviews_for_scoring(
+    settings_id: str,
+    tag: str,
+    after_id: str = "",
+    limit: int = 200,
+    conn: Connection | None = None,
+) -> list[Review]:
+    return await (conn or db).fetchall(
+        """
+        SELECT * FROM paidreviews.reviews
+        WHERE settings_id = :settings_id AND tag = :tag AND paid = :paid
+        AND hidden = :hidden AND id > :after_id
+        ORDER BY id
+        LIMIT :limit
+        """,
+        {
+            "settings_id": settings_id,
+            "tag": tag,
+            "paid": True,
+            "hidden": False,
+            "after_id": after_id,
+            "limit": limit,
+        },
+        Review,
+    )
+
+
+async def update_review_scores(
+    scores: dict[str, float], conn: Connection | None = None
+) -> None:
+    async with db.reuse_conn(conn) if conn else db.connect() as new_conn:
+        for review_id, score in scores.items():
+            await new_conn.execute(
+                "UPDATE paidreviews.reviews SET score = :score WHERE id = :id",
+                {"id": review_id, "score": score},
+            )
+
+
+async def delete_review(review_id: str, conn: Connection | None = None) -> None:
+    await (conn or db).execute(
         "DELETE FROM paidreviews.reviews WHERE id = :id",
         {"id": review_id},
     )
+
+
+async def get_unpaid_reviews(
+    since: int,
+    after_id: str = "",
+    limit: int = 200,
+    conn: Connection | None = None,
+) -> list[Review]:
+    """
+    Unpaid reviews with an invoice created after the `since` timestamp,
+    ordered by id so callers can page through them with `after_id`.
+    """
+    return await (conn or db).fetchall(
+        f"""
+        SELECT * FROM paidreviews.reviews
+        WHERE paid = :paid AND payment_hash != '' AND payment_hash != 'free'
+        AND created_at >= {db.timestamp_placeholder("since")}
+        AND id > :after_id
+        ORDER BY id
+        LIMIT :limit
+        """,
+        {"paid": False, "since": since, "after_id": after_id, "limit": limit},
+        Review,
+    )
+
+
+async def get_settled_payment_hashes(payment_hashes: list[str]) -> set[str]:
+    """
+    The subset of `payment_hashes` with a settled incoming payment in the
+    LNbits payments table, looked up in a single query.
+    """
+    if not payment_hashes:
+        return set()
+    keys = [f"hash_{i}" for i in range(len(payment_hashes))]
+    values: dict = dict(zip(keys, payment_hashes, strict=True))
+    values["status"] = PaymentState.SUCCESS.value
+    rows = await core_db.fetchall(
+        f"""
+        SELECT payment_hash FROM apipayments
+        WHERE payment_hash IN ({', '.join(f':{key}' for key in keys)})
+        AND amount > 0 AND status = :status
+        """,
+        values,
+    )
+    return {row["payment_hash"] for row in rows}
+
+
+def _bulk_moderation_where(settings_id: str, data: BulkModeration) -> tuple[str, dict]:
+    where = ["settings_id = :settings_id"]
+    values: dict = {"settings_id": settings_id}
+    if data.ids:
+        keys = [f"id_{i}" for i in range(len(data.ids))]
+        where.append(f"id IN ({', '.join(f':{key}' for key in keys)})")
+        values.update(dict(zip(keys, data.ids, strict=True)))
+    if data.tag:
+        where.append("tag = :tag")
+        values["tag"] = data.tag
+    if data.search:
+        where.append(
+            "(LOWER(name) LIKE :search ESCAPE '\\' "
+            "OR LOWER(comment) LIKE :search ESCAPE '\\')"
+        )
+        search = (
+            data.search.lower()
+            .replace("\\", "\\\\")
+            .replace("%", "\\%")
+            .replace("_", "\\_")
+        )
+        values["search"] = f"%{search}%"
+    if data.created_from:
+        where.append(f"created_at >= {db.timestamp_placeholder('created_from')}")
+        values["created_from"] = int(data.created_from.timestamp())
+    if data.created_to:
+        where.append(f"created_at <= {db.timestamp_placeholder('created_to')}")
+        values["created_to"] = int(data.created_to.timestamp())
+    return " AND ".join(where), values
+
+
+async def delete_reviews(
+    settings_id: str, data: BulkModeration, conn: Connection | None = None
+) -> int:
+    """
+    Delete every review of `settings_id` matching `data` in one statement.
+    Returns the number of deleted reviews.
+    """
+    where, values = _bulk_moderation_where(settings_id, data)
+    result = await (conn or db).execute(
+        f"DELETE FROM paidreviews.reviews WHERE {where}", values
+    )
+    return result.rowcount
+
+
+async def set_reviews_hidden(
+    settings_id: str,
+    data: BulkModeration,
+    hidden: bool,
+    conn: Connection | None = None,
+) -> int:
+    """
+    Hide or restore every review of `settings_id` matching `data` in one
+    statement. Returns the number of reviews changed.
+    """
+    where, values = _bulk_moderation_where(settings_id, data)
+    where = f"{where} AND hidden = :current"
+    values = {**values, "hidden": hidden, "current": not hidden}
+    result = await (conn or db).execute(
+        f"UPDATE paidreviews.reviews SET hidden = :hidden WHERE {where}", values
+    )
+    return result.rowcount
+
+
+############################# Tributes #############################
+
+
+async def create_tribute_accrual(
+    data: TributeAccrual, conn: Connection | None = None
+) -> TributeAccrual:
+    await (conn or db).insert("paidreviews.tributes", data)
+    return data
+
+
+async def get_tributes_due_for_settlement(
+    threshold_msat: int, older_than: int, conn: Connection | None = None
+) -> list[tuple[str, str]]:
+    """
+    (settings_id, wallet) pairs whose unsettled tributes reached
+    `threshold_msat`, or which hold at least one sat of tributes accrued
+    before the `older_than` timestamp.
+    """
+    rows = await (conn or db).fetchall(
+        f"""
+        SELECT settings_id, wallet
+        FROM paidreviews.tributes
+        WHERE settlement_id IS NULL
+        GROUP BY settings_id, wallet
+        HAVING SUM(amount_msat) >= 1000 AND (
+            SUM(amount_msat) >= :threshold_msat
+            OR MIN(created_at) < {db.timestamp_placeholder("older_than")}
+        )
+        """,
+        {"threshold_msat": threshold_msat, "older_than": older_than},
+    )
+    return [(row["settings_id"], row["wallet"]) for row in rows]
+
+
+async def get_tribute_failures(
+    settings_id: str, wallet: str, conn: Connection | None = None
+) -> int:
+    """
+    Number of failed settlements of a settings wallet since its last
+    successful one.
+    """
+    row = await (conn or db).fetchone(
+        """
+        SELECT COUNT(*) AS failures
+        FROM paidreviews.tribute_settlements s
+        WHERE s.settings_id = :settings_id AND s.wallet = :wallet
+        AND s.status = :failed
+        AND NOT EXISTS (
+            SELECT 1 FROM paidreviews.tribute_settlements ok
+            WHERE ok.settings_id = s.settings_id AND ok.wallet = s.wallet
+            AND ok.status = :success AND ok.created_at > s.created_at
+        )
+        """,
+        {
+            "settings_id": settings_id,
+            "wallet": wallet,
+            "failed": "failed",
+            "success": "success",
+        },
+    )
+    return int(row["failures"]) if row else 0
+
+
+async def has_tribute_failure_since(
+    settings_id: str, wallet: str, since: int, conn: Connection | None = None
+) -> bool:
+    row = await (conn or db).fetchone(
+        f"""
+        SELECT COUNT(*) AS failures
+        FROM paidreviews.tribute_settlements
+        WHERE settings_id = :settings_id AND wallet = :wallet
+        AND status = :failed
+        AND created_at >= {db.timestamp_placeholder("since")}
+        """,
+        {
+            "settings_id": settings_id,
+            "wallet": wallet,
+            "failed": "failed",
+            "since": since,
+        },
+    )
+    return bool(row and row["failures"])
+
+
+async def create_tribute_settlement(
+    settings_id: str, wallet: str, conn: Connection | None = None
+) -> TributeSettlement:
+    """
+    Claim every unsettled tribute of a settings wallet for a new pending
+    settlement. The settlement pays the whole sats of the claimed total, the
+    msat left over go back to the ledger once it succeeds.
+    """
+    settlement = TributeSettlement(settings_id=settings_id, wallet=wallet)
+    async with db.reuse_conn(conn) if conn else db.connect() as new_conn:
+        await new_conn.execute(
+            """
+            UPDATE paidreviews.tributes SET settlement_id = :settlement_id
+            WHERE settings_id = :settings_id AND wallet = :wallet
+            AND settlement_id IS NULL
+            """,
+            {
+                "settlement_id": settlement.id,
+                "settings_id": settings_id,
+                "wallet": wallet,
+            },
+        )
+        claimed_msat = await _get_settlement_claimed_msat(settlement.id, new_conn)
+        settlement.amount_msat = claimed_msat // 1000 * 1000
+        await new_conn.insert("paidreviews.tribute_settlements", settlement)
+    return settlement
+
+
+async def _get_settlement_claimed_msat(settlement_id: str, conn: Connection) -> int:
+    row = await conn.fetchone(
+        """
+        SELECT COALESCE(SUM(amount_msat), 0) AS amount_msat
+        FROM paidreviews.tributes WHERE settlement_id = :settlement_id
+        """,
+        {"settlement_id": settlement_id},
+    )
+    return int(row["amount_msat"])
+
+
+async def get_pending_tribute_settlements(
+    conn: Connection | None = None,
+) -> list[TributeSettlement]:
+    return await (conn or db).fetchall(
+        """
+        SELECT * FROM paidreviews.tribute_settlements
+        WHERE status = :status ORDER BY created_at
+        """,
+        {"status": "pending"},
+        TributeSettlement,
+    )
+
+
+async def update_tribute_settlement(
+    data: TributeSettlement, conn: Connection | None = None
+) -> TributeSettlement:
+    await (conn or db).update("paidreviews.tribute_settlements", data)
+    return data
+
+
+async def complete_tribute_settlement(
+    data: TributeSettlement, conn: Connection | None = None
+) -> TributeSettlement:
+    """
+    Mark a settlement as successful and write the msat it could not pay,
+    below one sat, back to the ledger as a new accrual.
+    """
+    data.status = "success"
+    async with db.reuse_conn(conn) if conn else db.connect() as new_conn:
+        claimed_msat = await _get_settlement_claimed_msat(data.id, new_conn)
+        leftover_msat = claimed_msat - data.amount_msat
+        if leftover_msat > 0:
+            await new_conn.insert(
+                "paidreviews.tributes",
+                TributeAccrual(
+                    settings_id=data.settings_id,
+                    wallet=data.wallet,
+                    amount_msat=leftover_msat,
+                ),
+            )
+        await new_conn.update("paidreviews.tribute_settlements", data)
+    return data
+
+
+async def release_tribute_settlement(
+    data: TributeSettlement, conn: Connection | None = None
+) -> TributeSettlement:
+    """
+    Mark a settlement as failed and hand its tributes back to the ledger,
+    so they are picked up by the next settlement run.
+    """
+    data.status = "failed"
+    async with db.reuse_conn(conn) if conn else db.connect() as new_conn:
+        await new_conn.execute(
+            """
+            UPDATE paidreviews.tributes SET settlement_id = NULL
+            WHERE settlement_id = :settlement_id
+            """,
+            {"settlement_id": data.id},
+        )
+        await new_conn.update("paidreviews.tribute_settlements", data)
+    return data
+
+
+async def get_tribute_report(
+    settings_id: str, limit: int = 50, conn: Connection | None = None
+) -> TributeReport:
+    report = await (conn or db).fetchone(
+        """
+        SELECT
+          (
+            SELECT COALESCE(SUM(t.amount_msat), 0)
+            FROM paidreviews.tributes t
+            LEFT JOIN paidreviews.tribute_settlements s
+              ON s.id = t.settlement_id
+            WHERE t.settings_id = :settings_id
+            AND (s.status IS NULL OR s.status != :success)
+          ) AS accrued_msat,
+          (
+            SELECT COUNT(*)
+            FROM paidreviews.tributes t
+            LEFT JOIN paidreviews.tribute_settlements s
+              ON s.id = t.settlement_id
+            WHERE t.settings_id = :settings_id
+            AND (s.status IS NULL OR s.status != :success)
+          ) AS pending_count,
+          (
+            SELECT COALESCE(SUM(amount_msat), 0)
+            FROM paidreviews.tribute_settlements
+            WHERE settings_id = :settings_id AND status = :success
+          ) AS settled_msat,
+          (
+            SELECT COUNT(*)
+            FROM paidreviews.tribute_settlements
+            WHERE settings_id = :settings_id AND status = :failed
+          ) AS failed_count
+        """,
+        {"settings_id": settings_id, "success": "success", "failed": "failed"},
+        TributeReport,
+    )
+    report = report or TributeReport()
+    report.settlements = await (conn or db).fetchall(
+        """
+        SELECT * FROM paidreviews.tribute_settlements
+        WHERE settings_id = :settings_id
+        ORDER BY created_at DESC
+        LIMIT :limit
+        """,
+        {"settings_id": settings_id, "limit": limit},
+        TributeSettlement,
+    )
+    return report
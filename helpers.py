@@ -0,0 +1,27 @@
+import math
+
+from .models import Review
+
+# number of "virtual" reviews at the settings' mean rating added to every
+# tag average when smoothing it (see `get_rating_stats`)
+SCORE_PRIOR_COUNT = 5
+# a review's score is worth half as much as a review this much newer (seconds)
+SCORE_HALF_LIFE = 30 * 24 * 60 * 60
+
+
+def review_score(review: Review, tag_avg_rating: float | None) -> float:
+    """
+    Ranking score of a review: its rating blended with the smoothed tag
+    average (the review's own rating if there is none yet), weighted by the
+    amount paid and decayed by age.
+
+    The decay is expressed as an offset growing with `created_at`, which
+    keeps the ordering of two reviews stable over time, so scores only
+    have to be refreshed when the tag average moves.
+    """
+    if tag_avg_rating is None:
+        tag_avg_rating = review.rating
+    rating = (review.rating + tag_avg_rating) / 2
+    weight = 1 + math.log10(1 + max(review.amount, 0))
+    recency = review.created_at.timestamp() / SCORE_HALF_LIFE * math.log10(2)
+    return math.log10(1 + rating * weight) + recency
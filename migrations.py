@@ -63,3 +63,115 @@ async def m003_average(db):
             WHERE paid = 1
             GROUP BY settings_id, tag;
             """)
+
+
+async def m004_tribute_ledger(db):
+    """
+    Tribute accrual ledger and settlement tables.
+    """
+    await db.execute(f"""
+        CREATE TABLE paidreviews.tributes (
+            id TEXT PRIMARY KEY NOT NULL,
+            settings_id TEXT NOT NULL DEFAULT '',
+            wallet TEXT NOT NULL DEFAULT '',
+            review_id TEXT,
+            amount_msat INTEGER NOT NULL DEFAULT 0,
+            settlement_id TEXT,
+            created_at TIMESTAMP NOT NULL DEFAULT {db.timestamp_now}
+        );
+    """)
+    if db.type in {"POSTGRES", "COCKROACH"}:
+        await db.execute("""
+            CREATE INDEX IF NOT EXISTS paidreviews_tributes_wallet_settlement
+            ON paidreviews.tributes (wallet, settlement_id);
+            """)
+        await db.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS paidreviews_tributes_review
+            ON paidreviews.tributes (review_id);
+            """)
+    elif db.type == "SQLITE":
+        await db.execute("""
+            CREATE INDEX IF NOT EXISTS
+            paidreviews.paidreviews_tributes_wallet_settlement
+            ON tributes (wallet, settlement_id);
+            """)
+        await db.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS paidreviews.paidreviews_tributes_review
+            ON tributes (review_id);
+            """)
+    await db.execute(f"""
+        CREATE TABLE paidreviews.tribute_settlements (
+            id TEXT PRIMARY KEY NOT NULL,
+            settings_id TEXT NOT NULL DEFAULT '',
+            wallet TEXT NOT NULL DEFAULT '',
+            amount_msat INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'pending',
+            payment_hash TEXT,
+            created_at TIMESTAMP NOT NULL DEFAULT {db.timestamp_now}
+        );
+    """)
+
+
+async def m005_hidden_reviews(db):
+    """
+    Add a hidden flag to reviews and leave hidden reviews out of the stats.
+    """
+    await db.execute(
+        "ALTER TABLE paidreviews.reviews ADD COLUMN hidden BOOLEAN DEFAULT FALSE;"
+    )
+    if db.type in {"POSTGRES", "COCKROACH"}:
+        await db.execute("""
+            CREATE OR REPLACE VIEW paidreviews.paidreviews_view_review_stats AS
+            SELECT
+              settings_id,
+              tag,
+              COUNT(*) AS review_count,
+              AVG(CAST(rating AS REAL)) AS avg_rating
+            FROM paidreviews.reviews
+            WHERE paid = TRUE AND hidden = FALSE
+            GROUP BY settings_id, tag;
+            """)
+    elif db.type == "SQLITE":
+        await db.execute(
+            "DROP VIEW IF EXISTS paidreviews.paidreviews_view_review_stats;"
+        )
+        await db.execute("""
+            CREATE VIEW paidreviews.paidreviews_view_review_stats AS
+            SELECT
+              settings_id,
+              tag,
+              COUNT(*) AS review_count,
+              AVG(CAST(rating AS REAL)) AS avg_rating
+            FROM reviews
+            WHERE paid = 1 AND hidden = 0
+            GROUP BY settings_id, tag;
+            """)
+
+
+async def m006_review_scores(db):
+    """
+    Add the paid amount and a precomputed ranking score to reviews.
+    Existing paid-for reviews are backfilled with the current cost, as the
+    price they were bought at is not recorded; free reviews keep 0.
+    """
+    await db.execute(
+        "ALTER TABLE paidreviews.reviews ADD COLUMN amount INTEGER DEFAULT 0;"
+    )
+    await db.execute("ALTER TABLE paidreviews.reviews ADD COLUMN score REAL DEFAULT 0;")
+    await db.execute("""
+        UPDATE paidreviews.reviews SET amount = COALESCE((
+            SELECT cost FROM paidreviews.prsettings
+            WHERE paidreviews.prsettings.id = paidreviews.reviews.settings_id
+        ), 0)
+        WHERE payment_hash != 'free';
+    """)
+    if db.type in {"POSTGRES", "COCKROACH"}:
+        await db.execute("""
+            CREATE INDEX IF NOT EXISTS paidreviews_reviews_score
+            ON paidreviews.reviews (settings_id, tag, score);
+            """)
+    elif db.type == "SQLITE":
+        await db.execute("""
+            CREATE INDEX IF NOT EXISTS paidreviews.paidreviews_reviews_score
+            ON reviews (settings_id, tag, score);
+            """)
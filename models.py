@@ -36,6 +36,9 @@ class Review(BaseModel):
     comment: str | None = Field(default=None)
     paid: bool = Field(default=False)
     payment_hash: str | None = Field(default=None)
+    hidden: bool = Field(default=False)
+    amount: int = Field(default=0, ge=0)
+    score: float = Field(default=0.0)
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 
@@ -46,14 +49,34 @@ class PostReview(BaseModel):
     comment: str | None = Query(None)
 
 
+class BulkModeration(BaseModel):
+    ids: list[str] = Field(default_factory=list)
+    tag: str | None = None
+    search: str | None = None
+    created_from: datetime | None = None
+    created_to: datetime | None = None
+
+    @property
+    def is_empty(self) -> bool:
+        return not (
+            self.ids or self.tag or self.search or self.created_from or self.created_to
+        )
+
+
+class BulkModerationResult(BaseModel):
+    affected: int = Field(0, ge=0)
+
+
 class ReviewstPage(Page[Review]):
     avg_rating: float = 0.0
+    bayes_avg_rating: float | None = None
 
 
 class RatingStats(BaseModel):
     tag: str | None = None
     review_count: int = Field(0, ge=0)
     avg_rating: int
+    bayes_avg_rating: float | None = None
 
 
 class RatingsFilters(FilterModel):
@@ -61,6 +84,35 @@ class RatingsFilters(FilterModel):
     __sort_fields__ = [
         "created_at",
         "name",
+        "score",
     ]
 
     name: str | None = None
+
+
+class TributeAccrual(BaseModel):
+    id: str = Field(default_factory=urlsafe_short_hash)
+    settings_id: str
+    wallet: str
+    review_id: str | None = None
+    amount_msat: int = Field(default=0, ge=0)
+    settlement_id: str | None = None
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+class TributeSettlement(BaseModel):
+    id: str = Field(default_factory=urlsafe_short_hash)
+    settings_id: str
+    wallet: str
+    amount_msat: int = Field(default=0, ge=0)
+    status: str = "pending"
+    payment_hash: str | None = None
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+class TributeReport(BaseModel):
+    accrued_msat: int = 0
+    settled_msat: int = 0
+    pending_count: int = 0
+    failed_count: int = 0
+    settlements: list[TributeSettlement] = Field(default_factory=list)
@@ -1,11 +1,73 @@
 import asyncio
+import os
+import time
 
+from lnbits import bolt11
+from lnbits.core.crud import get_standalone_payment
 from lnbits.core.models import Payment
 from lnbits.core.services import get_pr_from_lnurl, pay_invoice
+from lnbits.db import Connection
 from lnbits.tasks import register_invoice_listener
 from loguru import logger
 
-from .crud import get_review_by_hash, get_settings_from_id, update_review
+from .crud import (
+    complete_tribute_settlement,
+    create_tribute_accrual,
+    create_tribute_settlement,
+    db,
+    get_pending_tribute_settlements,
+    get_rating_stats,
+    get_rating_stats_for_all_tags,
+    get_review_by_hash,
+    get_reviews_for_scoring,
+    get_scored_settings_ids,
+    get_settings_from_id,
+    get_settled_payment_hashes,
+    get_tribute_failures,
+    get_tributes_due_for_settlement,
+    get_unpaid_reviews,
+    has_tribute_failure_since,
+    release_tribute_settlement,
+    set_review_paid,
+    update_review_scores,
+    update_tribute_settlement,
+)
+from .helpers import review_score
+from .models import PRSettings, Review, TributeAccrual, TributeSettlement
+
+
+def _env_seconds(name: str, default: int) -> int:
+    value = os.getenv(name)
+    if not value:
+        return default
+    try:
+        seconds = int(value)
+    except ValueError:
+        seconds = 0
+    if seconds <= 0:
+        logger.warning(f"paidreviews: invalid {name}={value!r}, using {default}")
+        return default
+    return seconds
+
+
+TRIBUTE_LNURL = "lnbits@nostr.com"
+TRIBUTE_PERCENT = 2
+# a wallet is settled once its unsettled tributes reach this amount...
+TRIBUTE_THRESHOLD_MSAT = 100_000
+# ...or once its oldest unsettled tribute is older than this (seconds)
+TRIBUTE_SETTLEMENT_INTERVAL = 24 * 60 * 60
+TRIBUTE_CHECK_INTERVAL = 10 * 60
+# longest wait between two attempts of a settlement that keeps failing
+TRIBUTE_RETRY_MAX_BACKOFF = 24 * 60 * 60
+# unpaid reviews older than this (seconds) are not checked for missed payments
+RECOVERY_LOOKBACK = _env_seconds("PAIDREVIEWS_RECOVERY_LOOKBACK", 7 * 24 * 60 * 60)
+RECOVERY_INTERVAL = 60 * 60
+RECOVERY_BATCH_SIZE = 200
+SCORE_REFRESH_INTERVAL = 60 * 60
+SCORE_BATCH_SIZE = 200
+
+# smoothed tag averages the current review scores were computed with
+_scored_tag_averages: dict[tuple[str, str], float | None] = {}
 
 
 async def wait_for_paid_invoices():
@@ -19,36 +81,223 @@ async def wait_for_paid_invoices():
 async def on_invoice_paid(payment: Payment) -> None:
     if payment.extra.get("tag") != "paidreviews":
         return
-    review = await get_review_by_hash(payment.payment_hash)
-    if not review:
-        return
-    logger.debug(review)
     try:
-        if payment and payment.payment_hash:
-            review.paid = True
-            review.payment_hash = payment.payment_hash
-            await update_review(review)
-            settings = await get_settings_from_id(review.settings_id)
-            if not settings:
-                return
-            await pay_tribute(settings.cost, settings.wallet)
-    except Exception:
+        async with db.connect() as conn:
+            await mark_review_paid(payment.payment_hash, conn)
+    except Exception as exc:
+        logger.warning(
+            f"paidreviews: could not mark review of payment "
+            f"{payment.payment_hash} as paid: {exc}"
+        )
+
+
+async def mark_review_paid(payment_hash: str, conn: Connection) -> bool:
+    """
+    Mark the review of `payment_hash` as paid and accrue its tribute.
+    Returns False if there is no such review or it was already paid, also
+    when a concurrent writer marked it paid first.
+    """
+    review = await get_review_by_hash(payment_hash, conn=conn)
+    if not review or review.paid:
+        return False
+    stats = await get_rating_stats(review.settings_id, review.tag or "", conn=conn)
+    review.score = review_score(review, stats.bayes_avg_rating)
+    if not await set_review_paid(payment_hash, review.score, conn=conn):
+        return False
+    review.paid = True
+    logger.debug(review)
+    settings = await get_settings_from_id(review.settings_id, conn=conn)
+    if settings:
+        await accrue_tribute(settings, review, conn=conn)
+    return True
+
+
+async def accrue_tribute(
+    settings: PRSettings, review: Review, conn: Connection | None = None
+) -> None:
+    """
+    Record the exact tribute owed for a paid review, it is paid out later
+    in bulk by `settle_tributes`.
+    """
+    amount_msat = settings.cost * 1000 * TRIBUTE_PERCENT // 100
+    if amount_msat <= 0:
         return
+    await create_tribute_accrual(
+        TributeAccrual(
+            settings_id=settings.id,
+            wallet=settings.wallet,
+            review_id=review.id,
+            amount_msat=amount_msat,
+        ),
+        conn=conn,
+    )
 
 
-async def pay_tribute(haircut_amount: int, wallet_id: str) -> None:
-    try:
-        tribute = int(2 * (haircut_amount / 100))
+async def run_tribute_settlement():
+    while True:
+        try:
+            await settle_tributes()
+        except Exception as exc:
+            logger.warning(f"paidreviews: tribute settlement failed: {exc}")
+        await asyncio.sleep(TRIBUTE_CHECK_INTERVAL)
+
+
+async def settle_tributes() -> None:
+    # settlements left pending by an earlier, interrupted run
+    for settlement in await get_pending_tribute_settlements():
+        await reconcile_tribute_settlement(settlement)
+
+    older_than = int(time.time()) - TRIBUTE_SETTLEMENT_INTERVAL
+    due = await get_tributes_due_for_settlement(TRIBUTE_THRESHOLD_MSAT, older_than)
+    for settings_id, wallet in due:
+        if await _tribute_backoff_active(settings_id, wallet):
+            continue
+        settlement = await create_tribute_settlement(settings_id, wallet)
+        if settlement.amount_msat < 1000:
+            await release_tribute_settlement(settlement)
+            continue
+        try:
+            pr = await get_pr_from_lnurl(TRIBUTE_LNURL, settlement.amount_msat)
+            settlement.payment_hash = bolt11.decode(pr).payment_hash
+        except Exception as exc:
+            logger.warning(
+                f"paidreviews: tribute settlement {settlement.id} failed: {exc}"
+            )
+            await release_tribute_settlement(settlement)
+            continue
+        # store the hash before paying, so an interrupted payment can be
+        # reconciled by the next run
+        await update_tribute_settlement(settlement)
+        try:
+            await pay_invoice(
+                wallet_id=wallet,
+                payment_request=pr,
+                max_sat=settlement.amount_msat // 1000,
+                description="Tribute to help support LNbits",
+            )
+        except Exception as exc:
+            logger.warning(
+                f"paidreviews: tribute settlement {settlement.id} failed: {exc}"
+            )
+        await reconcile_tribute_settlement(settlement)
+
+
+async def _tribute_backoff_active(settings_id: str, wallet: str) -> bool:
+    """
+    After each consecutive failed settlement of a settings wallet, wait twice
+    as long (up to `TRIBUTE_RETRY_MAX_BACKOFF`) before trying again.
+    """
+    failures = await get_tribute_failures(settings_id, wallet)
+    if not failures:
+        return False
+    backoff = min(
+        TRIBUTE_CHECK_INTERVAL * 2 ** (failures - 1), TRIBUTE_RETRY_MAX_BACKOFF
+    )
+    since = int(time.time()) - backoff
+    return await has_tribute_failure_since(settings_id, wallet, since)
+
+
+async def reconcile_tribute_settlement(settlement: TributeSettlement) -> None:
+    """
+    Finish a pending settlement from the state of its payment: mark it
+    successful once paid, leave it pending while the payment is in flight
+    and hand its tributes back to the ledger otherwise.
+    """
+    payment = None
+    if settlement.payment_hash:
+        payment = await get_standalone_payment(
+            settlement.payment_hash, incoming=False, wallet_id=settlement.wallet
+        )
+    if payment and payment.pending:
+        return
+    if payment and payment.success:
+        await complete_tribute_settlement(settlement)
+        logger.info(
+            f"paidreviews: settled {settlement.amount_msat} msat "
+            f"of tributes for wallet {settlement.wallet}"
+        )
+        return
+    await release_tribute_settlement(settlement)
+
+
+async def run_payment_recovery():
+    while True:
         try:
-            pr = await get_pr_from_lnurl("lnbits@nostr.com", tribute * 1000)
-        except Exception:
-            return
-        await pay_invoice(
-            wallet_id=wallet_id,
-            payment_request=pr,
-            max_sat=tribute,
-            description="Tribute to help support LNbits",
+            await recover_missed_payments()
+        except Exception as exc:
+            logger.warning(f"paidreviews: payment recovery failed: {exc}")
+        await asyncio.sleep(RECOVERY_INTERVAL)
+
+
+async def recover_missed_payments(
+    lookback: int = RECOVERY_LOOKBACK, batch_size: int = RECOVERY_BATCH_SIZE
+) -> int:
+    """
+    Mark reviews as paid whose invoices were settled while the invoice
+    listener was not running. Returns the number of recovered reviews.
+    """
+    since = int(time.time()) - lookback
+    checked = 0
+    recovered = 0
+    after_id = ""
+    while True:
+        reviews = await get_unpaid_reviews(since, after_id, batch_size)
+        if not reviews:
+            break
+        after_id = reviews[-1].id
+        checked += len(reviews)
+        paid_hashes = await get_settled_payment_hashes(
+            [review.payment_hash for review in reviews if review.payment_hash]
         )
-    except Exception:
-        pass
-    return
+        if paid_hashes:
+            async with db.connect() as conn:
+                for payment_hash in paid_hashes:
+                    if await mark_review_paid(payment_hash, conn):
+                        recovered += 1
+        logger.debug(
+            f"paidreviews: payment recovery checked {checked} unpaid reviews, "
+            f"recovered {recovered}"
+        )
+
+    if recovered:
+        logger.info(f"paidreviews: recovered {recovered} missed review payments")
+    return recovered
+
+
+async def run_score_refresh():
+    while True:
+        try:
+            await refresh_review_scores()
+        except Exception as exc:
+            logger.warning(f"paidreviews: score refresh failed: {exc}")
+        await asyncio.sleep(SCORE_REFRESH_INTERVAL)
+
+
+async def refresh_review_scores(batch_size: int = SCORE_BATCH_SIZE) -> None:
+    """
+    Recompute the ranking scores of the visible paid reviews of every tag
+    whose smoothed average moved since the last refresh, one transaction
+    per batch. The first refresh after startup covers every tag.
+    """
+    for settings_id in await get_scored_settings_ids():
+        for stats in await get_rating_stats_for_all_tags(settings_id):
+            if not stats.tag:
+                continue
+            key = (settings_id, stats.tag)
+            if _scored_tag_averages.get(key) == stats.bayes_avg_rating:
+                continue
+            after_id = ""
+            while True:
+                reviews = await get_reviews_for_scoring(
+                    settings_id, stats.tag, after_id, batch_size
+                )
+                if not reviews:
+                    break
+                after_id = reviews[-1].id
+                await update_review_scores(
+                    {
+                        review.id: review_score(review, stats.bayes_avg_rating)
+                        for review in reviews
+                    }
+                )
+            _scored_tag_averages[key] = stats.bayes_avg_rating
@@ -0,0 +1,40 @@
+import math
+from datetime import datetime, timedelta, timezone
+
+from ..helpers import SCORE_HALF_LIFE, review_score
+from ..models import Review
+
+NOW = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+def _review(**kwargs) -> Review:
+    kwargs.setdefault("created_at", NOW)
+    return Review(settings_id="settings", **kwargs)
+
+
+def test_review_score_higher_rating_ranks_higher():
+    assert review_score(_review(rating=5), 3) > review_score(_review(rating=2), 3)
+
+
+def test_review_score_paid_amount_weight():
+    cheap = review_score(_review(rating=4, amount=0), 3)
+    paid = review_score(_review(rating=4, amount=1000), 3)
+    assert paid > cheap
+
+
+def test_review_score_decays_by_half_life():
+    older = _review(rating=4)
+    newer = _review(rating=4, created_at=NOW + timedelta(seconds=SCORE_HALF_LIFE))
+    difference = review_score(newer, 3) - review_score(older, 3)
+    assert math.isclose(difference, math.log10(2))
+
+
+def test_review_score_recency_beats_small_rating_gap():
+    old_good = _review(rating=5)
+    new_ok = _review(rating=4, created_at=NOW + timedelta(seconds=SCORE_HALF_LIFE))
+    assert review_score(new_ok, 4) > review_score(old_good, 4)
+
+
+def test_review_score_without_tag_average_uses_own_rating():
+    review = _review(rating=4)
+    assert review_score(review, None) == review_score(review, 4)
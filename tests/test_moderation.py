@@ -0,0 +1,39 @@
+from datetime import datetime, timezone
+
+from ..crud import _bulk_moderation_where, db
+from ..models import BulkModeration
+
+
+def test_bulk_moderation_where_ids():
+    where, values = _bulk_moderation_where("settings", BulkModeration(ids=["a", "b"]))
+    assert where == "settings_id = :settings_id AND id IN (:id_0, :id_1)"
+    assert values == {"settings_id": "settings", "id_0": "a", "id_1": "b"}
+
+
+def test_bulk_moderation_where_pattern():
+    where, values = _bulk_moderation_where(
+        "settings", BulkModeration(tag="lnbits", search="50%_Off\\")
+    )
+    assert "tag = :tag" in where
+    assert "LOWER(name) LIKE :search ESCAPE '\\'" in where
+    assert "LOWER(comment) LIKE :search ESCAPE '\\'" in where
+    assert values["tag"] == "lnbits"
+    assert values["search"] == "%50\\%\\_off\\\\%"
+
+
+def test_bulk_moderation_where_date_range():
+    created_from = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    created_to = datetime(2025, 2, 1, tzinfo=timezone.utc)
+    where, values = _bulk_moderation_where(
+        "settings",
+        BulkModeration(created_from=created_from, created_to=created_to),
+    )
+    assert f"created_at >= {db.timestamp_placeholder('created_from')}" in where
+    assert f"created_at <= {db.timestamp_placeholder('created_to')}" in where
+    assert values["created_from"] == int(created_from.timestamp())
+    assert values["created_to"] == int(created_to.timestamp())
+
+
+def test_bulk_moderation_is_empty():
+    assert BulkModeration().is_empty
+    assert not BulkModeration(ids=["a"]).is_empty
@@ -0,0 +1,109 @@
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+import pytest
+
+from .. import tasks
+from ..models import Review
+
+
+class FakeRecovery:
+    def __init__(self, reviews: list[Review]):
+        self.reviews = sorted(reviews, key=lambda review: review.id)
+        self.settled: set[str] = set()
+        self.already_paid: set[str] = set()
+        self.pages: list[str] = []
+        self.lookups: list[list[str]] = []
+        self.marked: list[str] = []
+
+
+@pytest.fixture
+def recovery(monkeypatch):
+    def _recovery(*reviews: Review) -> FakeRecovery:
+        fake = FakeRecovery(list(reviews))
+
+        async def get_unpaid_reviews(since, after_id="", limit=200, conn=None):
+            fake.pages.append(after_id)
+            page = [review for review in fake.reviews if review.id > after_id]
+            return page[:limit]
+
+        async def get_settled_payment_hashes(payment_hashes):
+            fake.lookups.append(payment_hashes)
+            return {h for h in payment_hashes if h in fake.settled}
+
+        async def mark_review_paid(payment_hash, conn):
+            if payment_hash in fake.already_paid:
+                return False
+            fake.marked.append(payment_hash)
+            return True
+
+        @asynccontextmanager
+        async def connect():
+            yield None
+
+        monkeypatch.setattr(tasks, "get_unpaid_reviews", get_unpaid_reviews)
+        monkeypatch.setattr(
+            tasks, "get_settled_payment_hashes", get_settled_payment_hashes
+        )
+        monkeypatch.setattr(tasks, "mark_review_paid", mark_review_paid)
+        monkeypatch.setattr(tasks, "db", SimpleNamespace(connect=connect))
+        return fake
+
+    return _recovery
+
+
+def _review(review_id: str) -> Review:
+    return Review(id=review_id, settings_id="settings", payment_hash=f"h{review_id}")
+
+
+@pytest.mark.asyncio
+async def test_recovery_pages_by_id(recovery):
+    fake = recovery(*[_review(str(i)) for i in range(5)])
+
+    await tasks.recover_missed_payments(batch_size=2)
+
+    assert fake.pages == ["", "1", "3", "4"]
+    assert fake.lookups == [["h0", "h1"], ["h2", "h3"], ["h4"]]
+
+
+@pytest.mark.asyncio
+async def test_recovery_marks_only_settled_hashes(recovery):
+    fake = recovery(_review("a"), _review("b"), _review("c"))
+    fake.settled = {"ha", "hc"}
+
+    recovered = await tasks.recover_missed_payments()
+
+    assert recovered == 2
+    assert sorted(fake.marked) == ["ha", "hc"]
+
+
+@pytest.mark.asyncio
+async def test_recovery_skips_reviews_paid_by_the_listener(recovery):
+    fake = recovery(_review("a"), _review("b"))
+    fake.settled = {"ha", "hb"}
+    fake.already_paid = {"ha"}
+
+    recovered = await tasks.recover_missed_payments()
+
+    assert recovered == 1
+    assert fake.marked == ["hb"]
+
+
+@pytest.mark.asyncio
+async def test_recovery_without_unpaid_reviews(recovery):
+    fake = recovery()
+
+    assert await tasks.recover_missed_payments() == 0
+    assert fake.lookups == []
+
+
+@pytest.mark.parametrize(
+    ("value", "seconds"),
+    [(None, 60), ("", 60), ("3600", 3600), ("a week", 60), ("-5", 60)],
+)
+def test_env_seconds(monkeypatch, value, seconds):
+    if value is None:
+        monkeypatch.delenv("PAIDREVIEWS_TEST_SECONDS", raising=False)
+    else:
+        monkeypatch.setenv("PAIDREVIEWS_TEST_SECONDS", value)
+    assert tasks._env_seconds("PAIDREVIEWS_TEST_SECONDS", 60) == seconds
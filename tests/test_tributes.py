@@ -0,0 +1,293 @@
+from types import SimpleNamespace
+
+import pytest
+
+from .. import tasks
+from ..models import PRSettings, Review, TributeAccrual, TributeSettlement
+
+
+class FakeLedger:
+    def __init__(self):
+        self.accruals: list[TributeAccrual] = []
+        self.pending: list[TributeSettlement] = []
+        self.due: list[tuple[str, str]] = []
+        self.claimed_msat = 0
+        self.failures = 0
+        self.failed_recently = False
+        self.created: list[TributeSettlement] = []
+        self.completed: list[TributeSettlement] = []
+        self.released: list[TributeSettlement] = []
+
+
+class FakeLightning:
+    def __init__(self):
+        self.invoice_error: Exception | None = None
+        self.payment: SimpleNamespace | None = None
+        self.invoice_requests: list[int] = []
+        self.payments: list[dict] = []
+        self.lookups: list[str] = []
+
+
+@pytest.fixture
+def ledger(monkeypatch) -> FakeLedger:
+    fake = FakeLedger()
+
+    async def create_tribute_accrual(data, conn=None):
+        fake.accruals.append(data)
+        return data
+
+    async def get_pending_tribute_settlements(conn=None):
+        return fake.pending
+
+    async def get_tributes_due_for_settlement(threshold_msat, older_than, conn=None):
+        return fake.due
+
+    async def get_tribute_failures(settings_id, wallet, conn=None):
+        return fake.failures
+
+    async def has_tribute_failure_since(settings_id, wallet, since, conn=None):
+        return fake.failed_recently
+
+    async def create_tribute_settlement(settings_id, wallet, conn=None):
+        settlement = TributeSettlement(
+            settings_id=settings_id,
+            wallet=wallet,
+            amount_msat=fake.claimed_msat // 1000 * 1000,
+        )
+        fake.created.append(settlement)
+        return settlement
+
+    async def update_tribute_settlement(data, conn=None):
+        return data
+
+    async def complete_tribute_settlement(data, conn=None):
+        data.status = "success"
+        fake.completed.append(data)
+        return data
+
+    async def release_tribute_settlement(data, conn=None):
+        data.status = "failed"
+        fake.released.append(data)
+        return data
+
+    for func in (
+        create_tribute_accrual,
+        get_pending_tribute_settlements,
+        get_tributes_due_for_settlement,
+        get_tribute_failures,
+        has_tribute_failure_since,
+        create_tribute_settlement,
+        update_tribute_settlement,
+        complete_tribute_settlement,
+        release_tribute_settlement,
+    ):
+        monkeypatch.setattr(tasks, func.__name__, func)
+    return fake
+
+
+@pytest.fixture
+def lightning(monkeypatch) -> FakeLightning:
+    fake = FakeLightning()
+
+    async def get_pr_from_lnurl(lnurl, amount_msat):
+        if fake.invoice_error:
+            raise fake.invoice_error
+        fake.invoice_requests.append(amount_msat)
+        return "lnbc1invoice"
+
+    async def pay_invoice(**kwargs):
+        fake.payments.append(kwargs)
+
+    async def get_standalone_payment(payment_hash, incoming=None, wallet_id=None):
+        fake.lookups.append(payment_hash)
+        return fake.payment
+
+    monkeypatch.setattr(tasks, "get_pr_from_lnurl", get_pr_from_lnurl)
+    monkeypatch.setattr(tasks, "pay_invoice", pay_invoice)
+    monkeypatch.setattr(tasks, "get_standalone_payment", get_standalone_payment)
+    monkeypatch.setattr(
+        tasks,
+        "bolt11",
+        SimpleNamespace(decode=lambda pr: SimpleNamespace(payment_hash="hash")),
+    )
+    return fake
+
+
+def _payment(status: str) -> SimpleNamespace:
+    return SimpleNamespace(pending=status == "pending", success=status == "success")
+
+
+def _settlement(payment_hash: str | None = "hash") -> TributeSettlement:
+    return TributeSettlement(
+        settings_id="settings",
+        wallet="wallet",
+        amount_msat=101_000,
+        payment_hash=payment_hash,
+    )
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    ("cost", "amount_msat"),
+    [
+        (10, 200),  # int(2 * (10 / 100)) used to round this to 0 sat
+        (49, 980),
+        (51, 1020),
+        (1000, 20000),
+    ],
+)
+async def test_accrue_tribute_exact_msat(ledger, cost, amount_msat):
+    settings = PRSettings(wallet="wallet", cost=cost)
+    review = Review(settings_id=settings.id, rating=5)
+
+    await tasks.accrue_tribute(settings, review)
+
+    assert len(ledger.accruals) == 1
+    assert ledger.accruals[0].amount_msat == amount_msat
+    assert ledger.accruals[0].review_id == review.id
+    assert ledger.accruals[0].settings_id == settings.id
+    assert ledger.accruals[0].wallet == "wallet"
+
+
+@pytest.mark.asyncio
+async def test_accrue_tribute_free_review(ledger):
+    settings = PRSettings(wallet="wallet", cost=0)
+
+    await tasks.accrue_tribute(settings, Review(settings_id=settings.id))
+
+    assert ledger.accruals == []
+
+
+@pytest.mark.asyncio
+async def test_reconcile_in_flight_stays_pending(ledger, lightning):
+    lightning.payment = _payment("pending")
+    settlement = _settlement()
+
+    await tasks.reconcile_tribute_settlement(settlement)
+
+    assert settlement.status == "pending"
+    assert ledger.completed == []
+    assert ledger.released == []
+
+
+@pytest.mark.asyncio
+async def test_reconcile_success_completes(ledger, lightning):
+    lightning.payment = _payment("success")
+    settlement = _settlement()
+
+    await tasks.reconcile_tribute_settlement(settlement)
+
+    assert ledger.completed == [settlement]
+    assert ledger.released == []
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("payment", [_payment("failed"), None])
+async def test_reconcile_failed_or_missing_payment_releases(ledger, lightning, payment):
+    lightning.payment = payment
+    settlement = _settlement()
+
+    await tasks.reconcile_tribute_settlement(settlement)
+
+    assert ledger.released == [settlement]
+    assert ledger.completed == []
+
+
+@pytest.mark.asyncio
+async def test_reconcile_without_payment_hash_releases(ledger, lightning):
+    settlement = _settlement(payment_hash=None)
+
+    await tasks.reconcile_tribute_settlement(settlement)
+
+    assert lightning.lookups == []
+    assert ledger.released == [settlement]
+
+
+@pytest.mark.asyncio
+async def test_settle_reconciles_pending_first(ledger, lightning):
+    lightning.payment = _payment("success")
+    pending = _settlement()
+    ledger.pending = [pending]
+
+    await tasks.settle_tributes()
+
+    assert ledger.completed == [pending]
+    assert ledger.created == []
+
+
+@pytest.mark.asyncio
+async def test_settle_pays_whole_sats(ledger, lightning):
+    lightning.payment = _payment("success")
+    ledger.due = [("settings", "wallet")]
+    ledger.claimed_msat = 101_020
+
+    await tasks.settle_tributes()
+
+    assert lightning.invoice_requests == [101_000]
+    assert len(lightning.payments) == 1
+    assert lightning.payments[0]["wallet_id"] == "wallet"
+    assert lightning.payments[0]["max_sat"] == 101
+    assert ledger.created[0].payment_hash == "hash"
+    assert ledger.completed == ledger.created
+
+
+@pytest.mark.asyncio
+async def test_settle_below_one_sat_releases(ledger, lightning):
+    ledger.due = [("settings", "wallet")]
+    ledger.claimed_msat = 999
+
+    await tasks.settle_tributes()
+
+    assert lightning.invoice_requests == []
+    assert ledger.released == ledger.created
+
+
+@pytest.mark.asyncio
+async def test_settle_lnurl_error_releases(ledger, lightning):
+    lightning.invoice_error = RuntimeError("lnurl down")
+    ledger.due = [("settings", "wallet")]
+    ledger.claimed_msat = 5_000
+
+    await tasks.settle_tributes()
+
+    assert lightning.payments == []
+    assert ledger.released == ledger.created
+
+
+@pytest.mark.asyncio
+async def test_settle_in_flight_payment_stays_pending(ledger, lightning):
+    lightning.payment = _payment("pending")
+    ledger.due = [("settings", "wallet")]
+    ledger.claimed_msat = 5_000
+
+    await tasks.settle_tributes()
+
+    assert ledger.created[0].status == "pending"
+    assert ledger.completed == []
+    assert ledger.released == []
+
+
+@pytest.mark.asyncio
+async def test_settle_skips_wallet_in_backoff(ledger, lightning):
+    ledger.due = [("settings", "wallet")]
+    ledger.claimed_msat = 5_000
+    ledger.failures = 3
+    ledger.failed_recently = True
+
+    await tasks.settle_tributes()
+
+    assert ledger.created == []
+    assert lightning.invoice_requests == []
+
+
+@pytest.mark.asyncio
+async def test_settle_retries_after_backoff(ledger, lightning):
+    lightning.payment = _payment("success")
+    ledger.due = [("settings", "wallet")]
+    ledger.claimed_msat = 5_000
+    ledger.failures = 3
+    ledger.failed_recently = False
+
+    await tasks.settle_tributes()
+
+    assert len(ledger.completed) == 1
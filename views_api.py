@@ -4,29 +4,37 @@ import httpx
 from fastapi import APIRouter, Depends, HTTPException, Response
 from lnbits.core.models.users import AccountId
 from lnbits.core.services import create_invoice
-from lnbits.db import Filters
+from lnbits.db import Connection, Filters, Page
 from lnbits.decorators import check_account_id_exists, parse_filters
 
 from .crud import (
     RatingsFilters,
     create_review,
     create_settings,
+    db,
     delete_review,
+    delete_reviews,
     get_rating_stats,
     get_rating_stats_for_all_tags,
     get_review,
     get_reviews_by_tag,
     get_settings,
     get_settings_from_id,
+    get_tribute_report,
+    set_reviews_hidden,
     update_settings,
 )
+from .helpers import review_score
 from .models import (
+    BulkModeration,
+    BulkModerationResult,
     CreatePrSettings,
     PostReview,
     PRSettings,
     RatingStats,
     Review,
     ReviewstPage,
+    TributeReport,
 )
 
 paidreviews_api_router = APIRouter()
@@ -63,23 +71,41 @@ async def api_update_settings(
     data: CreatePrSettings,
     account_id: AccountId = Depends(check_account_id_exists),
 ) -> PRSettings:
+    async with db.connect() as conn:
+        settings = await get_settings_from_id(settings_id, conn=conn)
+        if not settings:
+            raise HTTPException(
+                status_code=HTTPStatus.NOT_FOUND, detail="Settings do not exist."
+            )
+
+        if settings.user_id != account_id.id:
+            raise HTTPException(
+                status_code=HTTPStatus.FORBIDDEN, detail="Not your reviews."
+            )
+
+        for field, value in data.dict().items():
+            if value is not None:
+                setattr(settings, field, value)
+
+        settings = await update_settings(settings, conn=conn)
+    return settings
+
+
+@paidreviews_api_router.get("/api/v1/settings/{settings_id}/tributes")
+async def api_tribute_report(
+    settings_id: str,
+    account_id: AccountId = Depends(check_account_id_exists),
+) -> TributeReport:
     settings = await get_settings_from_id(settings_id)
     if not settings:
         raise HTTPException(
             status_code=HTTPStatus.NOT_FOUND, detail="Settings do not exist."
         )
-
     if settings.user_id != account_id.id:
         raise HTTPException(
             status_code=HTTPStatus.FORBIDDEN, detail="Not your reviews."
         )
-
-    for field, value in data.dict().items():
-        if value is not None:
-            setattr(settings, field, value)
-
-    settings = await update_settings(settings)
-    return settings
+    return await get_tribute_report(settings_id)
 
 
 ############################## Tags #############################
@@ -157,21 +183,46 @@ async def api_reviews_by_tag(
     tag: str,
     filters: Filters = Depends(parse_filters(RatingsFilters)),
 ) -> ReviewstPage:
-    reviews = await get_reviews_by_tag(
-        settings_id=settings_id,
-        tag=tag,
-        filters=filters,
-    )
+    async with db.connect() as conn:
+        reviews = await get_reviews_by_tag(
+            settings_id=settings_id,
+            tag=tag,
+            filters=filters,
+            conn=conn,
+        )
 
-    stats = await get_rating_stats(settings_id, tag)
+        stats = await get_rating_stats(settings_id, tag, conn=conn)
 
     return ReviewstPage(
         data=reviews.data,  # type: ignore
         total=reviews.total,
         avg_rating=stats.avg_rating,
+        bayes_avg_rating=stats.bayes_avg_rating,
     )
 
 
+@paidreviews_api_router.get("/api/v1/{settings_id}/reviews/{tag}/hidden")
+async def api_hidden_reviews_by_tag(
+    settings_id: str,
+    tag: str,
+    filters: Filters = Depends(parse_filters(RatingsFilters)),
+    account_id: AccountId = Depends(check_account_id_exists),
+) -> Page[Review]:
+    async with db.connect() as conn:
+        settings = await get_settings(account_id.id, conn=conn)
+        if not settings or settings.id != settings_id:
+            raise HTTPException(
+                status_code=HTTPStatus.NOT_FOUND, detail="Settings do not exist."
+            )
+        return await get_reviews_by_tag(
+            settings_id=settings_id,
+            tag=tag,
+            filters=filters,
+            hidden=True,
+            conn=conn,
+        )
+
+
 @paidreviews_api_router.post(
     "/api/v1/{settings_id}/reviews", status_code=HTTPStatus.CREATED
 )
@@ -211,6 +262,7 @@ async def api_make_review(settings_id: str, data: PostReview) -> dict:
             rating=data.rating,
             comment=data.comment,
             paid=False,
+            amount=settings.cost or 0,
         )
 
         if not settings.cost or settings.cost == 0:
@@ -232,7 +284,10 @@ async def api_make_review(settings_id: str, data: PostReview) -> dict:
                 "payment_hash": payment.payment_hash,
                 "payment_request": payment.bolt11,
             }
-        await create_review(review)
+        async with db.connect() as conn:
+            stats = await get_rating_stats(settings.id, data.tag or "", conn=conn)
+            review.score = review_score(review, stats.bayes_avg_rating)
+            await create_review(review, conn=conn)
         return {"message": True}
 
     except Exception as e:
@@ -248,23 +303,80 @@ async def api_delete_review(
     review_id: str,
     account_id: AccountId = Depends(check_account_id_exists),
 ) -> None:
-    settings = await get_settings(account_id.id)
+    async with db.connect() as conn:
+        settings = await get_settings(account_id.id, conn=conn)
+        if not settings or settings.id != settings_id:
+            raise HTTPException(
+                status_code=HTTPStatus.NOT_FOUND, detail="Settings do not exist."
+            )
+        review = await get_review(review_id, conn=conn)
+        if not review or not review.settings_id:
+            raise HTTPException(
+                status_code=HTTPStatus.NOT_FOUND, detail="Review does not exist."
+            )
+
+        if settings.id != review.settings_id:
+            raise HTTPException(
+                status_code=HTTPStatus.NOT_FOUND, detail="Bad review id."
+            )
+        if settings.user_id != account_id.id:
+            raise HTTPException(
+                status_code=HTTPStatus.FORBIDDEN, detail="Not your extension."
+            )
+
+        await delete_review(review_id, conn=conn)
+    return
+
+
+############################# Moderation #############################
+
+
+async def _check_bulk_moderation(
+    settings_id: str, data: BulkModeration, account_id: AccountId, conn: Connection
+) -> None:
+    settings = await get_settings(account_id.id, conn=conn)
     if not settings or settings.id != settings_id:
         raise HTTPException(
             status_code=HTTPStatus.NOT_FOUND, detail="Settings do not exist."
         )
-    review = await get_review(review_id)
-    if not review or not review.settings_id:
+    if data.is_empty:
         raise HTTPException(
-            status_code=HTTPStatus.NOT_FOUND, detail="Review does not exist."
+            status_code=HTTPStatus.BAD_REQUEST,
+            detail="Provide ids, a tag, a search pattern or a date range.",
         )
 
-    if settings.id != review.settings_id:
-        raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="Bad review id.")
-    if settings.user_id != account_id.id:
-        raise HTTPException(
-            status_code=HTTPStatus.FORBIDDEN, detail="Not your extension."
-        )
 
-    await delete_review(review_id)
-    return
+@paidreviews_api_router.post("/api/v1/{settings_id}/reviews/bulk/delete")
+async def api_bulk_delete_reviews(
+    settings_id: str,
+    data: BulkModeration,
+    account_id: AccountId = Depends(check_account_id_exists),
+) -> BulkModerationResult:
+    async with db.connect() as conn:
+        await _check_bulk_moderation(settings_id, data, account_id, conn)
+        affected = await delete_reviews(settings_id, data, conn=conn)
+    return BulkModerationResult(affected=affected)
+
+
+@paidreviews_api_router.post("/api/v1/{settings_id}/reviews/bulk/hide")
+async def api_bulk_hide_reviews(
+    settings_id: str,
+    data: BulkModeration,
+    account_id: AccountId = Depends(check_account_id_exists),
+) -> BulkModerationResult:
+    async with db.connect() as conn:
+        await _check_bulk_moderation(settings_id, data, account_id, conn)
+        affected = await set_reviews_hidden(settings_id, data, hidden=True, conn=conn)
+    return BulkModerationResult(affected=affected)
+
+
+@paidreviews_api_router.post("/api/v1/{settings_id}/reviews/bulk/restore")
+async def api_bulk_restore_reviews(
+    settings_id: str,
+    data: BulkModeration,
+    account_id: AccountId = Depends(check_account_id_exists),
+) -> BulkModerationResult:
+    async with db.connect() as conn:
+        await _check_bulk_moderation(settings_id, data, account_id, conn)
+        affected = await set_reviews_hidden(settings_id, data, hidden=False, conn=conn)
+    return BulkModerationResult(affected=affected)